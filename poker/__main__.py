@@ -3,12 +3,20 @@ from gevent.monkey import patch_all
 patch_all()  # noqa: E402
 
 import logging
+from os import environ
 from signal import signal
 from signal import SIGTERM
 
+from gevent.pool import Pool
 from gevent.pywsgi import WSGIServer
 from poker.http import app
 
+# Bounds the number of open connections. Each one holds a greenlet for as long as it
+# is open, including idle keep-alive sockets and the page's 60s long-polls, so this
+# is sized for every open browser tab. Once the pool is full the server stops
+# accepting connections until one closes.
+GREENLET_POOL_SIZE = int(environ.get("POKER_GREENLET_POOL", 4096))
+
 
 def signal_handler(signum):
     raise SystemExit(1)
@@ -72,7 +80,7 @@ def route_bet(request: Request, name: str) -> Response:
 
 
 def main():
-    server = WSGIServer(("0.0.0.0", 6543), app)
+    server = WSGIServer(("0.0.0.0", 6543), app, spawn=Pool(GREENLET_POOL_SIZE))
     server.serve_forever()
 
 
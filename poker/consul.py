@@ -1,13 +1,67 @@
-import requests
+import msgpack
 import json
 import logging
-from base64 import b64decode
 from os import environ
+from threading import Event
+from urllib.parse import urlencode
+from urllib3 import connection_from_url
 
 logger = logging.getLogger(__name__)
 
 CONSUL_HTTP_ADDR = environ.get("CONSUL_HTTP_ADDR", "127.0.0.1:8500")
 
+# Keep-alive connections to Consul. Long-polls each hold a connection, so the pool
+# is sized for one per concurrent request.
+CONSUL_POOL_SIZE = 256
+
+_pool = connection_from_url(
+    f"http://{CONSUL_HTTP_ADDR}", maxsize=CONSUL_POOL_SIZE, retries=False
+)
+
+
+def _request(method, path, params=None, body=None):
+    url = f"/v1/kv{path}"
+    if params:
+        url += "?" + urlencode(params)
+
+    return _pool.urlopen(method, url, body=body)
+
+
+class _SharedQuery:
+    def __init__(self):
+        self.done = Event()
+        self.response = None
+        self.error = None
+
+
+# Blocking queries in flight, keyed by path and parameters. Everyone long-polling a
+# key at the same index is answered by a single request to Consul.
+_blocking_queries = dict()
+
+
+def _shared_request(path, params):
+    key = (path, tuple(sorted(params.items())))
+    query = _SharedQuery()
+    in_flight = _blocking_queries.setdefault(key, query)
+    if in_flight is not query:
+        in_flight.done.wait()
+        if in_flight.error is not None:
+            raise in_flight.error
+
+        return in_flight.response
+
+    try:
+        query.response = _request("GET", path, params)
+    except Exception as ex:
+        query.error = ex
+        raise
+    finally:
+        del _blocking_queries[key]
+        query.done.set()
+
+    return query.response
+
+
 # Consul utilities
 
 
@@ -19,46 +73,68 @@ class _NotPresent:
 NOT_PRESENT = _NotPresent()
 NO_CHANGE = object()
 
+# How long a mutate() retry blocks waiting for the key to move past the index its
+# CAS lost on. This must stay below any read timeout on the Consul socket.
+_CAS_RETRY_WAIT = "30s"
+
+# Values are stored as msgpack behind a magic byte. 0xc1 is never emitted by
+# msgpack, and legacy JSON values always start with "{", so both can be read.
+_MSGPACK_MAGIC = b"\xc1"
+
+
+def _encode(value):
+    return _MSGPACK_MAGIC + msgpack.packb(value, use_bin_type=True)
+
+
+def _decode(data):
+    if data.startswith(_MSGPACK_MAGIC):
+        return msgpack.unpackb(data[1:], raw=False)
+
+    return json.loads(data)
+
 
 class _Consul:
     @staticmethod
     def delete(path):
-        resp = requests.delete(f"http://{CONSUL_HTTP_ADDR}/v1/kv{path}",)
-        resp.raise_for_status()
-        return resp.json()
+        resp = _request("DELETE", path)
+        if resp.status != 200:
+            raise RuntimeError("Unexpected response", resp.status)
+
+        return json.loads(resp.data)
 
     @staticmethod
     def get(path, index=None, wait=None):
-        params = dict()
+        params = dict(raw="")
         if index is not None:
             params["index"] = index
 
         if wait is not None:
             params["wait"] = wait
 
-        resp = requests.get(f"http://{CONSUL_HTTP_ADDR}/v1/kv{path}", params=params,)
+        if wait is None:
+            resp = _request("GET", path, params)
+        else:
+            resp = _shared_request(path, params)
+
         index = resp.headers["X-Consul-Index"]
-        logger.info("GET %s <- %s", path, resp.status_code)
+        logger.info("GET %s <- %s", path, resp.status)
 
-        if resp.status_code == 404:
+        if resp.status == 404:
             return (index, NOT_PRESENT)
-        elif resp.status_code == 200:
-            value = resp.json()[0]["Value"]
-            decoded = json.loads(b64decode(value))
-            return index, decoded
+        elif resp.status == 200:
+            return index, _decode(resp.data)
 
-        raise RuntimeError("Unexpected response", resp.status_code)
+        raise RuntimeError("Unexpected response", resp.status)
 
     @staticmethod
-    def put(path, value, params=None, **kwargs):
-        resp = requests.put(
-            f"http://{CONSUL_HTTP_ADDR}/v1/kv{path}",
-            params=params,
-            json=value,
-            **kwargs,
-        )
-        logger.info("PUT %s <- %s", path, resp.text)
-        return resp.json()
+    def put(path, data, params=None):
+        resp = _request("PUT", path, params, data)
+        logger.info("PUT %s <- %s", path, resp.data)
+        if resp.status != 200:
+            raise RuntimeError("Unexpected response", resp.status)
+
+        # Consul answers a PUT with a JSON boolean, sometimes followed by a newline
+        return json.loads(resp.data) is True
 
 
 class ConsulKey:
@@ -66,24 +142,28 @@ class ConsulKey:
         self._path = path
 
     def get(self, *args, **kwargs):
-        ret = _Consul.get(self._path, *args, **kwargs)
-        return ret
+        return _Consul.get(self._path, *args, **kwargs)
 
-    def put(self, *args, **kwargs):
-        return _Consul.put(self._path, *args, **kwargs)
+    def put(self, value, *args, **kwargs):
+        return _Consul.put(self._path, _encode(value), *args, **kwargs)
 
     def delete(self, *args, **kwargs):
         return _Consul.delete(self._path, *args, **kwargs)
 
     def mutate(self, fn):
+        index = None
+        wait = None
         while True:
-            index, value = self.get()
-            if value is NOT_PRESENT:
-                index = 0
+            # After a failed CAS this is a blocking query: Consul answers as soon as
+            # the key has moved past the index we lost on, instead of us polling.
+            index, value = self.get(index=index, wait=wait)
+            cas = 0 if value is NOT_PRESENT else index
 
             new_value = fn(value)
             if new_value is NO_CHANGE:
                 return value
 
-            if self.put(new_value, params=dict(cas=index)):
+            if self.put(new_value, params=dict(cas=cas)):
                 return new_value
+
+            wait = _CAS_RETRY_WAIT
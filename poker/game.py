@@ -1,8 +1,9 @@
 import logging
 import unicodedata
+from functools import lru_cache
 from hashlib import sha256
+from random import Random
 from random import SystemRandom
-from itertools import cycle
 from pydantic import BaseModel
 from typing import Dict
 from typing import Optional
@@ -11,6 +12,8 @@ from typing import Tuple
 
 from poker.consul import ConsulKey
 from itertools import product
+from operator import attrgetter
+from poker.consul import NO_CHANGE
 from poker.consul import NOT_PRESENT
 from poker.hands import get_winners
 from poker.hands import find_best_hand
@@ -25,8 +28,12 @@ random = SystemRandom()
 # Deck management
 _NUMBERS = "AKQJX98765432"
 _SUITS = "SHCD"
-_CARDS = "".join([number + suit for number, suit in product(_NUMBERS, _SUITS)])
-_DISALLOWED_CHARACTERS = set(
+# Maps card indexes to their two-character names
+_CARD_TABLE = tuple(number + suit for number, suit in product(_NUMBERS, _SUITS))
+# Translation table that deletes every disallowed character
+_DISALLOWED_CHARACTERS = str.maketrans(
+    "",
+    "",
     # Control characters
     "\x00\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x0c\r\x0e\x0f\x10\x11\x12\x13\x14"
     "\x15\x16\x17\x18\x19\x1a\x1b\x1c\x1d\x1e\x1f\x7f\x80\x81\x82\x83\x84\x85\x86\x87"
@@ -34,10 +41,10 @@ _DISALLOWED_CHARACTERS = set(
     "\x9c\x9d\x9e\x9f"
     # Separators
     "\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a"
-    "\u2028\u2029\u202f\u205f\u3000"
+    "\u2028\u2029\u202f\u205f\u3000",
 )
 
-_SUIT_CODEPOINTS = dict(S="♠", H="♡", D="♢", C="♣")
+_SUIT_CODEPOINTS = str.maketrans(dict(S="♠", H="♡", D="♢", C="♣"))
 
 
 class Stage(IntEnum):
@@ -51,17 +58,11 @@ class SessionID(str):
     pass
 
 
-REVEALED_CARDS = {
-    Stage.PRE_FLOP: 0,
-    Stage.FLOP: 3,
-    Stage.TURN: 4,
-    Stage.RIVER: 5,
-}
+# Number of community cards revealed, indexed by Stage
+_REVEALED = (0, 3, 4, 5)
 
 
-def get_card(index):
-    index *= 2
-    return _CARDS[index : index + 2]
+get_card = _CARD_TABLE.__getitem__
 
 
 class Player(BaseModel):
@@ -93,6 +94,11 @@ class PlayerInHand(BaseModel):
 
 
 class Game(BaseModel):
+    # Maps session ids to positions in players, and the deck split into hole cards
+    # and community cards. Both are built on first use. players and deck are never
+    # reassigned: each hand gets a new Game.
+    __slots__ = ("_player_indexes", "_dealt")
+
     # arranged in bet order: dealer last
     players: List[PlayerInHand]
 
@@ -103,52 +109,57 @@ class Game(BaseModel):
     stage: int
     deck: str
 
-    def get_next_to_act(self, balances):
-        player_loop = cycle(self.players)
-
-        # Find the highest bettor
-        high_bettor = next(player_loop)
-        for player in player_loop:
-            if player is high_bettor:
-                break
-
-            if player.bet > high_bettor.bet:
-                high_bettor = player
+    def get_next_to_act(self, room):
+        room_players = room.players
+
+        # Action goes to the first player after the highest bettor (the first one,
+        # if several are tied) who can still act and has bet less than them. The
+        # high bettor is the first to reach the highest bet, so everyone seated
+        # before them has bet less. That lets one pass find both candidates.
+        high_idx = 0
+        high_bet = self.players[0].bet
+        first_can_act = None
+        first_can_act_idx = None
+        after_high_bettor = None
+        first_with_option = None
+        can_bet = 0
 
-        # By exiting the loop after seeing high bettor, we have already rotated the
-        # players list into the appropriate position.
+        for idx, player in enumerate(self.players):
+            if player.bet > high_bet:
+                high_idx = idx
+                high_bet = player.bet
+                after_high_bettor = None
 
-        can_bet = 0
-        for _, player in zip(self.players, player_loop):
             if player.eligibility is None:
                 continue
 
-            if balances[player.session_id] == 0:
+            if room_players[player.session_id].balance == 0:
                 continue
 
-            if player.bet < high_bettor.bet:
-                return player.session_id
-
             can_bet += 1
+            if first_can_act is None:
+                first_can_act = player
+                first_can_act_idx = idx
 
-        # All of the players are equal. Look for one with the option
+            if after_high_bettor is None and player.bet < high_bet:
+                after_high_bettor = player
 
-        if can_bet >= 2:
-            for player in self.players:
-                if not player.has_option:
-                    continue
+            if first_with_option is None and player.has_option:
+                first_with_option = player
 
-                if player.eligibility is None:
-                    continue
+        if after_high_bettor is not None:
+            return after_high_bettor.session_id
 
-                if balances[player.session_id] == 0:
-                    continue
+        if first_can_act is not None and first_can_act_idx < high_idx:
+            return first_can_act.session_id
 
-                return player.session_id
+        # All of the players are equal. Look for one with the option
+        if can_bet >= 2 and first_with_option is not None:
+            return first_with_option.session_id
 
         return None
 
-    def _should_do_more_betting_rounds(self, balances):
+    def _should_do_more_betting_rounds(self):
         """Given that the pot is good for this round, returns whether there should be
         more betting action for this entire hand."""
 
@@ -164,27 +175,35 @@ class Game(BaseModel):
 
         return False
 
-    def _finalize_betting(self, balances):
+    def _finalize_betting(self):
         # The pot is good. Calculate eligibility. A player's eligibility is equal to
         # the sum of the bets < theirs, plus their bet times the number of bets
         # >= theirs.
         cumulative = 0
         bets_above = len(self.players)
-        bets = sorted(self.players, key=lambda x: x.bet)
+        bets = sorted(self.players, key=attrgetter("bet"))
 
         players_in = 0
 
+        # These values are always valid, so write them straight into the model
+        # rather than through BaseModel.__setattr__.
+        set_field = object.__setattr__
+
         for player in bets:
             round_bet = player.bet
 
             # We're moving to the next round: reset bets to zero
-            player.bet = 0
-            player.has_option = True
+            set_field(player, "bet", 0)
+            set_field(player, "has_option", True)
 
             # TODO: I'm not sure eligibility is doing us any good.
             # It may be better to track the amount a player has paid into the pot.
             if player.eligibility is not None:
-                player.eligibility += cumulative + round_bet * bets_above
+                set_field(
+                    player,
+                    "eligibility",
+                    player.eligibility + cumulative + round_bet * bets_above,
+                )
                 players_in += 1
 
             cumulative += round_bet
@@ -194,22 +213,20 @@ class Game(BaseModel):
 
     # Advances the game state machine
     def advance_state(self, room):
-        balances = room.get_balances()
-
         while True:
-            next_to_act = self.get_next_to_act(balances)
+            next_to_act = self.get_next_to_act(room)
             if next_to_act is not None:
                 return
 
             # There is no next player to act. The pot is good.
-            if self._finalize_betting(balances) < 2:
+            if self._finalize_betting() < 2:
                 # Everyone folded.
                 break
 
             if self.stage == Stage.RIVER:
                 break
 
-            if not self._should_do_more_betting_rounds(balances):
+            if not self._should_do_more_betting_rounds():
                 logger.info("Should not do more betting rounds")
                 break
 
@@ -219,33 +236,30 @@ class Game(BaseModel):
         room.new_game(self)
 
     def _get_player_idx(self, session_id):
-        for idx, player in enumerate(self.players):
-            if player.session_id != session_id:
-                continue
-
-            return idx
+        player_indexes = getattr(self, "_player_indexes", None)
+        if player_indexes is None:
+            player_indexes = dict(
+                (player.session_id, idx) for idx, player in enumerate(self.players)
+            )
+            object.__setattr__(self, "_player_indexes", player_indexes)
 
-        raise KeyError(session_id)
+        return player_indexes[session_id]
 
     def get_player(self, session_id):
-        for player in self.players:
-            if player.session_id != session_id:
-                continue
-
-            return player
-
-        raise KeyError(session_id)
+        return self.players[self._get_player_idx(session_id)]
 
     def fold(self, room, session_id):
+        """Returns whether the fold was accepted."""
         if not self._check_can_bet(session_id, room):
-            return
+            return False
 
         bettor = self.get_player(session_id)
         bettor.eligibility = None
         bettor.has_option = False
+        return True
 
     def _check_can_bet(self, session_id, room):
-        return session_id == self.get_next_to_act(room.get_balances())
+        return session_id == self.get_next_to_act(room)
 
     def _bet(self, room, session_id, value):
         bettor = self.get_player(session_id)
@@ -253,7 +267,7 @@ class Game(BaseModel):
         if needed < 0:
             return None
 
-        min_bet = max([i.bet for i in self.players])
+        min_bet = max(player.bet for player in self.players)
         if value < min_bet and not (min_bet > room.players[bettor.session_id].balance):
             return None
 
@@ -264,34 +278,30 @@ class Game(BaseModel):
         return got
 
     def bet(self, room, session_id, value, lt_ok=False):
+        """Returns whether the bet was accepted."""
         if not self._check_can_bet(session_id, room):
-            return
+            return False
 
-        self._bet(room, session_id, value)
+        return self._bet(room, session_id, value) is not None
 
     def _live_players(self, room):
-        balances = room.get_balances()
-        return [p for p in self.players if balances.get(p.session_id, 0) > 0]
+        room_players = room.players
+        return [p for p in self.players if room_players[p.session_id].balance > 0]
 
-    def big_blind(self, room) -> PlayerInHand:
+    def blinds(self, room) -> Tuple[PlayerInHand, PlayerInHand]:
+        """Returns the small blind and big blind players."""
         live_players = self._live_players(room)
         if len(live_players) == 2:
-            return live_players[0]
+            big_blind, small_blind = live_players
         else:
-            return live_players[1]
+            small_blind, big_blind = live_players[0:2]
 
-    def small_blind(self, room) -> PlayerInHand:
-        live_players = self._live_players(room)
-        if len(live_players) == 2:
-            return live_players[1]
-        else:
-            return live_players[0]
+        return small_blind, big_blind
 
     def initialize(self, room):
         small_blind = room.small_blind
 
-        small_blind_player = self.small_blind(room)
-        big_blind_player = self.big_blind(room)
+        small_blind_player, big_blind_player = self.blinds(room)
 
         pot = 0
         pot += self._bet(room, small_blind_player.session_id, small_blind)
@@ -301,9 +311,22 @@ class Game(BaseModel):
         small_blind_player.has_option = True
         big_blind_player.has_option = True
 
+    def _get_dealt(self):
+        dealt = getattr(self, "_dealt", None)
+        if dealt is None:
+            deck = self.deck
+            community_start = len(self.players) * 4
+            hole = tuple(
+                deck[deck_index : deck_index + 4]
+                for deck_index in range(0, community_start, 4)
+            )
+            dealt = (hole, deck[community_start:])
+            object.__setattr__(self, "_dealt", dealt)
+
+        return dealt
+
     def _hole_cards_idx(self, idx):
-        deck_index = idx * 4
-        return self.deck[deck_index : deck_index + 4]
+        return self._get_dealt()[0][idx]
 
     def hole_cards(self, session_id):
         idx = self._get_player_idx(session_id)
@@ -311,10 +334,7 @@ class Game(BaseModel):
 
     @property
     def community_cards(self):
-        start = len(self.players) * 4
-        end = start + REVEALED_CARDS[self.stage] * 2
-
-        return self.deck[start:end]
+        return self._get_dealt()[1][: _REVEALED[self.stage] * 2]
 
     def _get_final_hands(self):
         community_cards = self.community_cards
@@ -328,7 +348,7 @@ class Game(BaseModel):
 
             hole_cards = self._hole_cards_idx(idx)
             yield player.session_id, (
-                player.copy(),
+                player.eligibility,
                 hole_cards,
                 find_best_hand(community_cards + hole_cards)
                 if self.stage == Stage.RIVER
@@ -341,10 +361,13 @@ class Game(BaseModel):
         )
         room.log.append(completed_game)
 
-        # Maps player ids -> (player, hole cards, Hand)
-        final_hands: Dict[str, Tuple[PlayerInHand, str, Hand]] = dict(
-            self._get_final_hands()
-        )
+        # Maps player ids -> (eligibility, hole cards, Hand)
+        final_hands: Dict[str, Tuple[int, str, Hand]] = dict(self._get_final_hands())
+
+        # Every payout reduces every remaining player's eligibility by the same
+        # amount, so the order of eligibilities never changes. Rather than
+        # decrementing each player per payout, track the total paid out so far.
+        paid = 0
 
         max_payouts = len(final_hands)
         while self.pot > 0:
@@ -357,10 +380,9 @@ class Game(BaseModel):
                 logger.info("Winners:  %s", winners)
                 winning_players = [s_id for (s_id, _) in winners]
 
-            eliminated = []
             # Eligibility is odd, we have to take the minimum of the
             # winning eligibility and divide it between the winners
-            amount = min(final_hands[s][0].eligibility for s in winning_players) // len(
+            amount = (min(final_hands[s][0] for s in winning_players) - paid) // len(
                 winning_players
             )
 
@@ -388,16 +410,15 @@ class Game(BaseModel):
 
             for s_id in winning_players:
                 pay_player(s_id, amount)
-                # Now remove all players that are no longer eligible to win
-                for (p_id, (p, _, _)) in final_hands.items():
-                    p.eligibility -= amount
-                    if p.eligibility <= 0:
-                        eliminated.append(p_id)
                 self.pot -= amount
-                print(self.pot)
 
-            for p_elim in eliminated:
-                del final_hands[p_elim]
+            # Now remove all players that are no longer eligible to win
+            paid += amount * len(winning_players)
+            final_hands = dict(
+                (s_id, final_hand)
+                for (s_id, final_hand) in final_hands.items()
+                if final_hand[0] > paid
+            )
 
             max_payouts -= 1
             # Infinite loop bug?
@@ -437,13 +458,8 @@ class PlayerAfterGame(BaseModel):
         return ret
 
 
-def _get_card_char(s):
-    ret = _SUIT_CODEPOINTS.get(s, s)
-    return ret
-
-
 def _convert_card_string(s):
-    return "".join(map(_get_card_char, s))
+    return s.translate(_SUIT_CODEPOINTS)
 
 
 class CompletedGame(BaseModel):
@@ -474,16 +490,13 @@ class Room(BaseModel):
 
         return None
 
-    def get_balances(self):
-        return dict((k, p.balance) for (k, p) in self.players.items())
-
     def player(self, session_id):
         return self.players[session_id]
 
     def _add_pending_players_to_game_list(self, players):
         in_game = set(player.session_id for player in players)
         pending_players = [
-            PlayerInHand(session_id=session_id, bet=0)
+            PlayerInHand.construct(session_id=session_id, bet=0)
             for session_id in self.players.keys()
             if session_id not in in_game
         ]
@@ -519,18 +532,20 @@ class Room(BaseModel):
             in_hand = []
             previous_pot = 0
         else:
-            rotate_by = 1
-            for player in previous_game.players:
+            # The first player who still has chips becomes the dealer
+            previous_players = previous_game.players
+            for rotate_by, player in enumerate(previous_players, 1):
                 if self.players[player.session_id].balance > 0:
                     break
-                rotate_by += 1
+            else:
+                rotate_by = 0
 
-            rotated_players = (
-                previous_game.players[rotate_by:] + previous_game.players[0:rotate_by]
-            )
+            num_players = len(previous_players)
             in_hand = [
-                PlayerInHand(session_id=player.session_id, bet=0)
-                for player in rotated_players
+                PlayerInHand.construct(
+                    session_id=previous_players[idx % num_players].session_id, bet=0
+                )
+                for idx in range(rotate_by, rotate_by + num_players)
             ]
             previous_pot = previous_game.pot
 
@@ -538,7 +553,9 @@ class Room(BaseModel):
 
         # TODO(joey): I think we should be doing len of in hand but ...
         deck = _make_deck(len(self.players))
-        game = Game(players=in_hand, deck=deck, pot=previous_pot, stage=0,)
+        # Everything here comes from already-validated state. Game(...) would
+        # revalidate, and copy, every PlayerInHand.
+        game = Game.construct(players=in_hand, deck=deck, pot=previous_pot, stage=0)
         self.game = game
         game.initialize(self)
 
@@ -546,32 +563,67 @@ class Room(BaseModel):
 def _make_deck(num_players):
     # Two hole cards per player plus the community cards
     cards_drawn = num_players * 2 + 5
-    number_deck = list(range(52))
-    random.shuffle(number_deck)
-    return "".join(get_card(card) for card in number_deck[:cards_drawn])
+    # Every draw from SystemRandom is a syscall. Take one 128-bit seed from it per
+    # hand and deal from a Mersenne Twister seeded with that. Sampling draws only
+    # as many numbers as there are cards dealt.
+    number_deck = Random(random.getrandbits(128)).sample(range(52), cards_drawn)
+    return "".join(map(get_card, number_deck))
+
+
+def _construct_room(value):
+    """Builds a Room from state that we wrote ourselves, skipping validation."""
+    game = value.get("game")
+    if game is not None:
+        game = Game.construct(
+            **dict(
+                game, players=[PlayerInHand.construct(**p) for p in game["players"]],
+            )
+        )
+
+    return Room.construct(
+        **dict(
+            value,
+            game=game,
+            players=dict(
+                (session_id, Player.construct(**player))
+                for (session_id, player) in value["players"].items()
+            ),
+            log=[
+                CompletedGame.construct(
+                    community_cards=completed["community_cards"],
+                    players=dict(
+                        (session_id, PlayerAfterGame.construct(**player))
+                        for (session_id, player) in completed["players"].items()
+                    ),
+                )
+                for completed in value["log"]
+            ],
+        )
+    )
 
 
 class PydanticConsulKey(ConsulKey):
-    def __init__(self, path, typ):
-        self._path = path
-        self._typ = typ
-        super().__init__
+    def __init__(self, path, construct):
+        super().__init__(path)
+        self._construct = construct
 
     def get(self, *args, **kwargs):
         index, value = super().get(*args, **kwargs)
         if value is not NOT_PRESENT:
-            value = self._typ(**value)
+            value = self._construct(value)
 
         return index, value
 
     def put(self, value, *args, **kwargs):
-        value = value.dict(exclude_unset=True)
+        value = value.dict()
         return super().put(value, *args, **kwargs)
 
 
+# Keys hold no per-request state, so every request for a room can share one
+@lru_cache(maxsize=1024)
 def _room(name):
     hashed_name = sha256(name.encode("utf-8")).hexdigest()
-    return PydanticConsulKey(f"/room/{hashed_name}", Room)
+    return PydanticConsulKey(f"/room/{hashed_name}", _construct_room)
 
 
 class AlertException(Exception):
@@ -590,7 +642,7 @@ def register(room_name: str, session_id: str, player_name: str):
     room_state = _room(room_name)
     player_name = unicodedata.normalize("NFKC", player_name)
 
-    if any(True for c in player_name if c in _DISALLOWED_CHARACTERS):
+    if len(player_name.translate(_DISALLOWED_CHARACTERS)) != len(player_name):
         raise CannotRegister("Your name contains disallowed characters")
 
     if not player_name:
@@ -671,7 +723,11 @@ def add_bet(name: str, session_id: str, value: int):
     room_state = _room(name)
 
     def mutation(room):
-        room.game.bet(room, session_id, value)
+        # A rejected bet leaves the game as it was: there is nothing to advance
+        # and nothing to write back.
+        if not room.game.bet(room, session_id, value):
+            return NO_CHANGE
+
         room.game.advance_state(room)
         return room
 
@@ -682,7 +738,9 @@ def fold(name: str, session_id: str):
     room_state = _room(name)
 
     def mutation(room):
-        room.game.fold(room, session_id)
+        if not room.game.fold(room, session_id):
+            return NO_CHANGE
+
         room.game.advance_state(room)
         return room
 
@@ -716,7 +774,7 @@ class PlayerRoomView(BaseModel):
     admin_name: Optional[str]
     players: Dict[str, dict]
     game: Optional[PlayerGameView]
-    log: List[CompletedGame]
+    log: List[dict]
 
 
 def _get_game_view(session_id, room_state):
@@ -724,25 +782,21 @@ def _get_game_view(session_id, room_state):
     if game is None:
         return None
 
-    for idx, player in enumerate(game.players):
-        if player.session_id == session_id:
-            break
-    else:
+    try:
+        idx = game._get_player_idx(session_id)
+    except KeyError:
         # Player is not in this game
         # They are "in the waiting room"
         return None
 
-    deck_index = idx * 4
-    community_start = len(game.players) * 4
-    community_end = community_start + REVEALED_CARDS[game.stage] * 2
-    next_to_act = game.get_next_to_act(room_state.get_balances())
+    next_to_act = game.get_next_to_act(room_state)
 
     return PlayerGameView(
         should_act=next_to_act == session_id,
         next_to_act=room_state.player(next_to_act).name,
         pot=game.pot,
-        hole_cards=game.deck[deck_index : deck_index + 4],
-        community_cards=game.deck[community_start:community_end],
+        hole_cards=game._hole_cards_idx(idx),
+        community_cards=game.community_cards,
         players=[
             dict(
                 name=room_state.player(p.session_id).name,
@@ -755,36 +809,41 @@ def _get_game_view(session_id, room_state):
     )
 
 
-def _convert_log(room_state):
-    for game in room_state.log:
-        community_cards = game.community_cards
-        game.community_cards = _convert_card_string(game.community_cards)
-
-        game.players = dict(
-            (room_state.get_name(session_id), result.show(community_cards))
-            for (session_id, result) in game.players.items()
+def _convert_log(room_state, names):
+    """Renders the log newest first. room_state itself is left untouched."""
+    return [
+        dict(
+            community_cards=_convert_card_string(game.community_cards),
+            players={
+                names[session_id]: result.show(game.community_cards)
+                for (session_id, result) in game.players.items()
+            },
         )
+        for game in reversed(room_state.log)
+    ]
 
 
 def _show_room(my_session_id: SessionID, room_state):
     if room_state is NOT_PRESENT:
         return None
 
+    names = {
+        session_id: player.name for (session_id, player) in room_state.players.items()
+    }
     myself = room_state.players.get(my_session_id, None)
     if room_state.admin is not None:
-        admin_name = room_state.get_name(room_state.admin)
+        admin_name = names[room_state.admin]
     else:
         admin_name = None
-    _convert_log(room_state)
 
     return PlayerRoomView(
         name=myself.name if myself else None,
         admin_name=admin_name,
-        players=dict(
-            (player.name, dict(balance=player.balance))
-            for s_id, player in room_state.players.items()
-        ),
-        log=list(reversed(room_state.log)),
+        players={
+            player.name: {"balance": player.balance}
+            for player in room_state.players.values()
+        },
+        log=_convert_log(room_state, names),
         game=_get_game_view(my_session_id, room_state),
     )
 
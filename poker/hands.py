@@ -1,5 +1,6 @@
 from enum import IntEnum
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import List
 
 
@@ -15,37 +16,13 @@ class Value(IntEnum):
     STRAIGHT_FLUSH = 9
 
 
-class NotACard(Exception):
-    pass
+_SUITS = "SHCD"
+# Maps the first character of a card to its value
+_VALUES = dict((char, value) for (value, char) in enumerate("23456789XJQKA"))
 
 
-class Card(str):
-    def __init__(self, value):
-        if len(self) != 2:
-            raise NotACard
-
-    @property
-    def value(self):
-        # Alternatively we could encode cards in descending order across ASCII
-        code = self[0]
-        if code == "A":
-            return 12
-        if code == "K":
-            return 11
-        if code == "Q":
-            return 10
-        if code == "J":
-            return 9
-        if code == "X":
-            return 8
-        return ord(code) - 50
-
-    @property
-    def suit(self):
-        return self[1]
-
-    def __lt__(self, other):
-        return self.value < other.value
+def _card_value(card):
+    return _VALUES[card[0]]
 
 
 @dataclass
@@ -56,69 +33,65 @@ class Hand:
     def __init__(self, value, cards):
         self.value = value
         self.cards = "".join(cards)
-
-        if isinstance(cards, str):
-            cards = [Card(cards[i : i + 2]) for i in range(0, len(cards), 2)]
-
-        self.sort_key = (self.value, [c.value for c in cards])
+        self.sort_key = (self.value, tuple(_VALUES[c] for c in self.cards[::2]))
 
         if len(self.cards) != 10:
             raise ValueError("Hand has wrong length", self.cards)
 
 
-def _get_value_groups(cards):
-    ret = [[] for _ in range(13)]
+def _group_by_value(cards):
+    """Maps each value present in cards, which must be sorted highest first, to its
+    cards in the order given."""
+    by_value = dict()
     for card in cards:
-        ret[card.value].append(card)
+        by_value.setdefault(_VALUES[card[0]], []).append(card)
 
-    return ret
+    return by_value
 
 
-def get_flushes(value_groups: List[Card]):
-    suits = dict(S=[], H=[], C=[], D=[])
-    for group in value_groups[::-1]:
-        for card in group:
-            suits[card.suit].append(card)
+# (top card value, bitmask of the values in the straight), highest first. Value -1
+# wraps around to the ace, which lets it play low.
+_STRAIGHTS = [
+    (i, sum(1 << (j % 13) for j in range(i, i - 5, -1))) for i in range(12, 2, -1)
+]
 
-    for suit, suit_cards in suits.items():
-        if len(suit_cards) < 5:
-            continue
 
-        value_groups = _get_value_groups(suit_cards)
-        straight = get_straight(value_groups)
-        if straight:
-            return Hand(Value.STRAIGHT_FLUSH, straight.cards)
+def _straight_top(mask):
+    for top, straight in _STRAIGHTS:
+        if mask & straight == straight:
+            return top
 
-        # With 7 cards available, the presence of a flush precludes the presence of
-        # the (higher valued) full house or four of a kind.
-        return Hand(Value.FLUSH, suit_cards[0:5])
+    return None
 
 
-def get_straight(value_groups: List[Card]):
-    for i in range(12, 2, -1):
-        bounds = range(i, i - 5, -1)
-        if not all(value_groups[j] for j in bounds):
-            continue
+# Maps a bitmask of the values present in a hand to the value of the top card of
+# its highest straight, or None if it has no straight.
+_STRAIGHT_TOPS = tuple(_straight_top(mask) for mask in range(1 << 13))
 
-        ret_cards = [value_groups[j][0] for j in bounds]
-        return Hand(Value.STRAIGHT, ret_cards)
 
+def get_straight(by_value):
+    mask = 0
+    for value in by_value:
+        mask |= 1 << value
 
-def get_matched_values(grouped) -> List[Card]:
-    lengths: List[List[Card]] = [[] for _ in range(4)]
+    top = _STRAIGHT_TOPS[mask]
+    if top is None:
+        return None
 
-    for group in grouped[::-1]:
-        lengths[len(group) - 1].extend(group)
+    return [by_value[j % 13][0] for j in range(top, top - 5, -1)]
 
-    # A quad
-    if lengths[3]:
-        value = lengths[3][0].value
-        for group in grouped:
-            if not group or group[0].value == value:
-                continue
 
-            kicker = group[0]
+def get_matched_values(by_value) -> Hand:
+    # Cards of each value, bucketed by how many cards share that value
+    lengths: List[List[str]] = [[] for _ in range(4)]
+
+    for group in by_value.values():
+        lengths[len(group) - 1].extend(group)
 
+    # A quad. The kicker is the highest card of any other value.
+    if lengths[3]:
+        value = _VALUES[lengths[3][0][0]]
+        kicker = next(group[0] for (v, group) in by_value.items() if v != value)
         return Hand(Value.QUAD, lengths[3] + [kicker])
 
     # Two sets
@@ -134,7 +107,7 @@ def get_matched_values(grouped) -> List[Card]:
 
     # Three pairs. Only two count
     if len(lengths[1]) > 4:
-        kicker = max(lengths[1][4], lengths[0][0])
+        kicker = max(lengths[1][4], lengths[0][0], key=_card_value)
         return Hand(Value.TWO_PAIRS, lengths[1][0:4] + [kicker])
 
     # Two pairs
@@ -149,29 +122,41 @@ def get_matched_values(grouped) -> List[Card]:
     return Hand(Value.CARD, lengths[0][0:5])
 
 
-def _find_best_hand(cards):
-    grouped = _get_value_groups(cards)
+# Every view of a room re-evaluates the hands shown in its log, so the same card
+# strings come back over and over. Callers must not modify the returned Hand.
+@lru_cache(maxsize=4096)
+def find_best_hand(card_str):
+    cards = [card_str[i : i + 2] for i in range(0, len(card_str), 2)]
+    # Highest value first. The sort is stable, so cards of equal value keep the
+    # order they were given in.
+    cards.sort(key=_card_value, reverse=True)
+
+    suits = card_str[1::2]
+    for suit in _SUITS:
+        if suits.count(suit) < 5:
+            continue
 
-    hand = get_flushes(grouped)
-    if hand:
-        return hand
+        suit_cards = [card for card in cards if card[1] == suit]
+        straight = get_straight(_group_by_value(suit_cards))
+        if straight:
+            return Hand(Value.STRAIGHT_FLUSH, straight)
+
+        # With 7 cards available, the presence of a flush precludes the presence of
+        # the (higher valued) full house or four of a kind.
+        return Hand(Value.FLUSH, suit_cards[0:5])
 
-    matched_values = get_matched_values(grouped)
+    by_value = _group_by_value(cards)
+    matched_values = get_matched_values(by_value)
     if matched_values.value in (Value.QUAD, Value.FULL_HOUSE):
         return matched_values
 
-    hand = get_straight(grouped)
-    if hand is not None:
-        return hand
+    straight = get_straight(by_value)
+    if straight is not None:
+        return Hand(Value.STRAIGHT, straight)
 
     return matched_values
 
 
-def find_best_hand(card_str):
-    cards = [Card(card_str[i : i + 2]) for i in range(0, len(card_str), 2)]
-    return _find_best_hand(cards)
-
-
 def _get_winners(hands):
     it = iter(sorted(hands, key=lambda hand: hand[1].sort_key, reverse=True))
     first = next(it)
@@ -184,4 +169,15 @@ def _get_winners(hands):
 
 
 def get_winners(hands):
+    hands = list(hands)
+
+    # Heads-up showdowns are the common case. Compare the two directly.
+    if len(hands) == 2:
+        first, second = hands
+        if first[1].sort_key > second[1].sort_key:
+            return [first]
+        if first[1].sort_key < second[1].sort_key:
+            return [second]
+        return hands
+
     return list(_get_winners(hands))
@@ -1,17 +1,20 @@
-import json
 import logging
 import os
+import orjson
+import re
 from importlib.resources import read_binary
 from importlib.resources import open_text
 
 from werkzeug.exceptions import HTTPException
-from werkzeug.http import dump_cookie
+from werkzeug.exceptions import InternalServerError
+from werkzeug.exceptions import ServiceUnavailable
 from werkzeug.routing import Map
 from werkzeug.routing import Rule
 from werkzeug.wrappers import Request
 from werkzeug.wrappers import Response
 
 from base64 import urlsafe_b64encode
+from functools import lru_cache
 from hashlib import sha256
 from random import Random
 
@@ -29,10 +32,10 @@ _MEMORY_FILENAMES = [
 MEMORY_ASSETS = dict((name, read_binary("poker", name)) for name in _MEMORY_FILENAMES)
 
 with open_text("poker", "nouns.txt") as nouns:
-    NOUNS = [l.strip() for l in nouns]
+    NOUNS = tuple(l.strip() for l in nouns)
 
 with open_text("poker", "adjectives.txt") as nouns:
-    ADJECTIVES = [l.strip() for l in nouns]
+    ADJECTIVES = tuple(l.strip() for l in nouns)
 
 COOKIE_KEY = "id"
 CS_POLICY = "; ".join(
@@ -43,40 +46,65 @@ CS_POLICY = "; ".join(
     ]
 )
 
+# Finds an id we minted in the Cookie header, without parsing the other cookies.
+# Anything else in its place is ignored and replaced with a fresh id.
+_COOKIE_ID = re.compile(r"(?:^|;)\s*" + COOKIE_KEY + r"=([A-Za-z0-9_-]{22})\s*(?:;|$)")
+_COOKIE_PREFIX = COOKIE_KEY + "="
+_COOKIE_SUFFIX = "; Max-Age=86400; HttpOnly; Path=/; SameSite=Lax"
+
+# Sent with every response
+_STATIC_HEADERS = [
+    ("Content-Security-Policy", CS_POLICY),
+    ("Referrer-Policy", "no-referrer"),
+]
+
 
 def base64url(b):
-    return urlsafe_b64encode(b).split(b"=")[0].decode("ascii")
+    return urlsafe_b64encode(b).rstrip(b"=").decode("ascii")
 
 
+# Clients send the same cookie on every request, so most lookups are cache hits
+@lru_cache(maxsize=65536)
 def hash_cookie_id(s):
     hashed = sha256(s.encode("utf-8")).digest()[:16]
     return base64url(hashed)
 
 
+def _cookie_header(cookie_id):
+    # Cookie ids are always base64url, which needs no quoting. Expires is left
+    # out: Max-Age takes precedence over it.
+    return _COOKIE_PREFIX + cookie_id + _COOKIE_SUFFIX
+
+
 def _get_cookie_id(request):
-    try:
-        return request.cookies[COOKIE_KEY]
-    except KeyError:
-        pass
+    match = _COOKIE_ID.search(request.environ.get("HTTP_COOKIE", ""))
+    if match is not None:
+        return match.group(1)
 
     return base64url(os.urandom(16))
 
 
+# These never change, so they are built once and shared by every request.
+# identity_middleware must not modify them.
+_SPA_RESPONSE = Response(
+    MEMORY_ASSETS["index.html"],
+    headers=(("Content-Type", "text/html; charset=utf-8"),),
+)
+_CHIME_RESPONSE = Response(
+    MEMORY_ASSETS["chime.oga"],
+    headers=(("Content-Type", "audio/ogg"), ("Cache-Control", "public, max-age: 600"),),
+)
+# For actions whose result the client picks up from its next room poll. Joining
+# still answers 200: the page treats anything else from join as an error.
+_NO_CONTENT = Response(status=204)
+
+
 def route_spa(request, room_name):
-    return Response(
-        MEMORY_ASSETS["index.html"],
-        headers=(("Content-Type", "text/html; charset=utf-8"),),
-    )
+    return _SPA_RESPONSE
 
 
 def route_chime(request):
-    return Response(
-        MEMORY_ASSETS["chime.oga"],
-        headers=(
-            ("Content-Type", "audio/ogg"),
-            ("Cache-Control", "public, max-age: 600"),
-        ),
-    )
+    return _CHIME_RESPONSE
 
 
 def route_show_room(request, room_name) -> Response:
@@ -86,7 +114,7 @@ def route_show_room(request, room_name) -> Response:
 
 
 def route_join(request, room_name) -> Response:
-    data = json.load(request.stream)
+    data = orjson.loads(request.get_data(cache=False))
     try:
         game.register(room_name, request.session_id, data["name"].strip())
     except game.CannotRegister as ex:
@@ -94,12 +122,14 @@ def route_join(request, room_name) -> Response:
 
 
 def route_bet(request, room_name) -> Response:
-    data = json.load(request.stream)
+    data = orjson.loads(request.get_data(cache=False))
     game.add_bet(room_name, request.session_id, data["amount"])
+    return _NO_CONTENT
 
 
 def route_fold(request, room_name) -> Response:
     game.fold(room_name, request.session_id)
+    return _NO_CONTENT
 
 
 def route_start(request, room_name) -> Response:
@@ -110,19 +140,21 @@ def route_start(request, room_name) -> Response:
     except game.CannotStart as ex:
         return Response(ex.args[0], status=400)
 
+    return _NO_CONTENT
+
 
 def route_cash(request, room_name) -> Response:
-    data = json.load(request.stream)
+    data = orjson.loads(request.get_data(cache=False))
     try:
         game.increment_balance(room_name, request.session_id, **data)
     except game.NotAdmin as ex:
         return ex.as_response()
 
+    return _NO_CONTENT
+
 
 def _random_name():
-    return "{}-{}-{}".format(
-        random.choice(ADJECTIVES), random.choice(ADJECTIVES), random.choice(NOUNS),
-    )
+    return "-".join((*random.choices(ADJECTIVES, k=2), random.choice(NOUNS)))
 
 
 def route_room_redirect(request) -> Response:
@@ -131,6 +163,8 @@ def route_room_redirect(request) -> Response:
         if not game.room_exists(name):
             return Response("", status=302, headers=(("Location", "/r/" + name),))
 
+    raise ServiceUnavailable("Could not find an unused room name. Try again.")
+
 
 url_map = Map(
     [
@@ -146,6 +180,39 @@ url_map = Map(
     ]
 )
 
+# The same routes as url_map, looked up directly so that the common requests skip
+# binding a MapAdapter. Room routes are keyed by the path segment after the room
+# name, or None for the room itself.
+_STATIC_ENDPOINTS = {
+    "/": route_room_redirect,
+    "/static/chime.oga": route_chime,
+}
+_ROOM_ENDPOINTS = {
+    None: route_show_room,
+    "bet": route_bet,
+    "fold": route_fold,
+    "join": route_join,
+    "start": route_start,
+    "cash": route_cash,
+}
+
+
+def _match(path):
+    endpoint = _STATIC_ENDPOINTS.get(path)
+    if endpoint is not None:
+        return endpoint, dict()
+
+    parts = path.split("/")
+    if len(parts) == 3 and parts[1] == "r" and parts[2]:
+        return route_spa, dict(room_name=parts[2])
+
+    if 4 <= len(parts) <= 5 and parts[1] == "api" and parts[2] == "room" and parts[3]:
+        endpoint = _ROOM_ENDPOINTS.get(parts[4] if len(parts) == 5 else None)
+        if endpoint is not None:
+            return endpoint, dict(room_name=parts[3])
+
+    return None, None
+
 
 def identity_middleware(environ, start_response):
     request = Request(environ)
@@ -154,21 +221,22 @@ def identity_middleware(environ, start_response):
 
     response = dispatch(request)
     if not isinstance(response, Response):
-        response = Response(
-            json.dumps(response), headers=(("Content-Type", "application/json"),)
-        )
-
-    cookie_header = dump_cookie(
-        key=COOKIE_KEY,
-        value=cookie_id.encode("ascii"),
-        max_age=86400,
-        httponly=True,
-        samesite="lax",
-    )
-    response.headers.add("Set-Cookie", cookie_header)
-    response.headers.add("Content-Security-Policy", CS_POLICY)
-    response.headers.add("Referrer-Policy", "no-referrer")
-    return response(environ, start_response)
+        response = Response(orjson.dumps(response), content_type="application/json")
+
+    cookie_header = _cookie_header(cookie_id)
+
+    # Add the headers to the WSGI header list rather than to the response, which
+    # may be shared between requests.
+    def add_headers(status, headers, exc_info=None):
+        headers.append(("Set-Cookie", cookie_header))
+        headers += _STATIC_HEADERS
+        return start_response(status, headers, exc_info)
+
+    return response(environ, add_headers)
+
+
+# Shared by every failed request, like the static responses above
+_INTERNAL_ERROR_RESPONSE = InternalServerError().get_response()
 
 
 def exceptions_middleware(environ, start_response):
@@ -176,13 +244,17 @@ def exceptions_middleware(environ, start_response):
         return identity_middleware(environ, start_response)
     except HTTPException as ex:
         return ex(environ, start_response)
-    except:  # noqa: E722
+    except Exception:
         logger.exception("Exception in request")
+        return _INTERNAL_ERROR_RESPONSE(environ, start_response)
 
 
 def dispatch(request):
-    urls = url_map.bind_to_environ(request.environ)
-    endpoint, args = urls.match()
+    endpoint, args = _match(request.path)
+    if endpoint is None:
+        # Let werkzeug produce the appropriate 404 or redirect
+        endpoint, args = url_map.bind_to_environ(request.environ).match()
+
     return endpoint(request, **args)
 
 
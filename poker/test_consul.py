@@ -0,0 +1,138 @@
+import json
+from threading import Event
+from threading import Lock
+from threading import Thread
+
+from poker import consul
+from poker.consul import _decode
+from poker.consul import _encode
+
+from pytest import raises
+
+ROOM = dict(
+    admin="a",
+    small_blind=1,
+    players=dict(a=dict(name="blah a", balance=100, pending_balance=0)),
+    game=None,
+    log=[],
+)
+
+
+def test_msgpack_round_trip():
+    data = _encode(ROOM)
+    assert data.startswith(b"\xc1")
+    assert _decode(data) == ROOM
+
+
+def test_decode_legacy_json():
+    assert _decode(json.dumps(ROOM).encode("utf-8")) == ROOM
+
+
+class MockResponse:
+    def __init__(self, status, data):
+        self.status = status
+        self.data = data
+
+
+def test_put_reply_with_newline(monkeypatch):
+    replies = iter([b"true\n", b"false\n"])
+    monkeypatch.setattr(
+        consul, "_request", lambda *args: MockResponse(200, next(replies))
+    )
+
+    assert consul._Consul.put("/room/x", b"") is True
+    assert consul._Consul.put("/room/x", b"") is False
+
+
+def test_put_unexpected_status(monkeypatch):
+    monkeypatch.setattr(
+        consul, "_request", lambda *args: MockResponse(500, b"rpc error")
+    )
+
+    with raises(RuntimeError):
+        consul._Consul.put("/room/x", b"")
+
+
+class CountingEvent(Event):
+    """Sets arrived once the expected number of callers are waiting"""
+
+    def __init__(self, expected):
+        super().__init__()
+        self.expected = expected
+        self.arrived = Event()
+        self._waiting = 0
+        self._lock = Lock()
+
+    def wait(self, timeout=None):
+        with self._lock:
+            self._waiting += 1
+            if self._waiting == self.expected:
+                self.arrived.set()
+
+        return super().wait(timeout)
+
+
+def _share_blocking_query(monkeypatch, upstream, followers=3):
+    """Runs one caller into upstream, then more callers for the same query while it
+    is in flight. Returns what each caller got and how often upstream ran."""
+    params = dict(raw="", index="7", wait="60s")
+    entered = Event()
+    release = Event()
+    calls = []
+
+    def request(method, path, params):
+        calls.append((method, path, params))
+        entered.set()
+        release.wait(5)
+        return upstream()
+
+    monkeypatch.setattr(consul, "_request", request)
+
+    results = []
+
+    def call():
+        try:
+            results.append(consul._shared_request("/room/x", params))
+        except Exception as ex:
+            results.append(ex)
+
+    threads = [Thread(target=call)]
+    threads[0].start()
+    assert entered.wait(5)
+
+    (query,) = consul._blocking_queries.values()
+    query.done = CountingEvent(followers)
+    threads += [Thread(target=call) for _ in range(followers)]
+    for thread in threads[1:]:
+        thread.start()
+    assert query.done.arrived.wait(5)
+
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    return results, calls
+
+
+def test_shared_request_single_upstream(monkeypatch):
+    response = MockResponse(200, b"")
+    results, calls = _share_blocking_query(monkeypatch, lambda: response)
+
+    assert len(calls) == 1
+    assert len(results) == 4
+    assert all(result is response for result in results)
+    assert consul._blocking_queries == dict()
+
+
+def test_shared_request_error(monkeypatch):
+    error = ConnectionError("consul went away")
+
+    def upstream():
+        raise error
+
+    results, calls = _share_blocking_query(monkeypatch, upstream)
+
+    assert len(calls) == 1
+    assert len(results) == 4
+    assert all(result is error for result in results)
+    assert consul._blocking_queries == dict()
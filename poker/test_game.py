@@ -11,12 +11,16 @@ from poker.hands import Value
 from poker.hands import Hand
 from random import Random
 
+from pytest import fixture
 from pytest import raises
 
+#                 a      c      b      community
+PLAY_HAND_DECK = "2S3S" "8SKH" "3H2D" "6DKD9D9SAH"
 
-def test_play_hand(monkeypatch):
-    monkeypatch.setattr(game, "random", Random(0))
 
+@fixture(scope="module")
+def seeded_room():
+    """Three registered players with 100 chips each and no game in progress"""
     game.delete_room("test")
     game.register("test", "a", "blah a")
     game.increment_balance("test", "a", name="blah a", amount=100)
@@ -25,6 +29,15 @@ def test_play_hand(monkeypatch):
     game.register("test", "c", "other")
     game.increment_balance("test", "a", name="other", amount=100)
 
+    return _room("test").get()[1]
+
+
+def test_play_hand(monkeypatch, seeded_room):
+    monkeypatch.setattr(game, "random", Random(0))
+    monkeypatch.setattr(game, "_make_deck", lambda num_players: PLAY_HAND_DECK)
+
+    _room("test").put(seeded_room.copy(deep=True))
+
     view_a = game.get_player_view("test", "a")
     assert view_a.game is None
 
@@ -117,6 +130,22 @@ def test_play_hand(monkeypatch):
     assert players["blah a"]["balance"] == 94
 
 
+def test_make_deck(monkeypatch):
+    monkeypatch.setattr(game, "random", Random(0))
+
+    deck = _make_deck(3)
+    assert len(deck) == 22
+
+    # No card is dealt twice
+    assert len(set(deck[i : i + 2] for i in range(0, len(deck), 2))) == 11
+
+
+def _at_showdown(session_id, eligibility):
+    return PlayerInHand(
+        session_id=session_id, bet=0, eligibility=eligibility, has_option=False
+    )
+
+
 class MockRoom:
     def __init__(self):
         self.log = list()
@@ -127,18 +156,19 @@ def test_sidepot_random(monkeypatch):
     monkeypatch.setattr(game, "random", Random(0))
 
     test_players = [
-        PlayerInHand(session_id="ls", bet=0, eligibility=3, has_option=False),
+        _at_showdown("ls", 3),
         # Want this player to win first
-        PlayerInHand(session_id="w", bet=0, eligibility=5, has_option=False),
+        _at_showdown("w", 5),
         # But then these players split because hilarious raisins
-        PlayerInHand(session_id="wb", bet=0, eligibility=8, has_option=False),
-        PlayerInHand(session_id="lb", bet=0, eligibility=8, has_option=False),
+        _at_showdown("wb", 8),
+        _at_showdown("lb", 8),
     ]
     finished_game = Game(
         players=test_players,
         stage=Stage.RIVER,
         pot=max(tp.eligibility for tp in test_players),
-        deck=_make_deck(len(test_players)),
+        #     ls     w      wb     lb     community
+        deck=("7SJS" "3H4H" "5CKD" "KH5S" "AH2H6HASKS"),
     )
     room = MockRoom()
     room.players = {
@@ -162,15 +192,16 @@ def test_normal_pot(monkeypatch):
     monkeypatch.setattr(game, "random", Random(0))
 
     test_players = [
-        PlayerInHand(session_id="ls", bet=0, eligibility=5, has_option=False),
-        PlayerInHand(session_id="w", bet=0, eligibility=5, has_option=False),
-        PlayerInHand(session_id="lb", bet=0, eligibility=5, has_option=False),
+        _at_showdown("ls", 5),
+        _at_showdown("w", 5),
+        _at_showdown("lb", 5),
     ]
     finished_game = Game(
         players=test_players,
         stage=Stage.RIVER,
         pot=max(tp.eligibility for tp in test_players),
-        deck=_make_deck(len(test_players)),
+        #     ls     w      lb     community
+        deck=("7SJS" "3H4H" "5CKD" "KH5SAH2H6H"),
     )
     room = MockRoom()
     room.players = {
@@ -187,12 +218,12 @@ def test_normal_pot(monkeypatch):
 
 def test_sidepot_1():
     test_players = [
-        PlayerInHand(session_id="ls", bet=0, eligibility=None, has_option=False),
+        _at_showdown("ls", None),
         # Want w and wb to split the pot
-        PlayerInHand(session_id="w", bet=0, eligibility=10, has_option=False),
-        PlayerInHand(session_id="wb", bet=0, eligibility=20, has_option=False),
+        _at_showdown("w", 10),
+        _at_showdown("wb", 20),
         # This player should unevenly lose their chips
-        PlayerInHand(session_id="lb", bet=0, eligibility=20, has_option=False),
+        _at_showdown("lb", 20),
     ]
     finished_game = Game(
         players=test_players,
@@ -219,10 +250,10 @@ def test_sidepot_1():
 
 def test_showdown_no_show():
     test_players = [
-        PlayerInHand(session_id="ls", bet=0, eligibility=None, has_option=False),
+        _at_showdown("ls", None),
         # Want this player to win first
-        PlayerInHand(session_id="w", bet=0, eligibility=20, has_option=False),
-        PlayerInHand(session_id="lb", bet=0, eligibility=None, has_option=False),
+        _at_showdown("w", 20),
+        _at_showdown("lb", None),
     ]
     finished_game = Game(
         players=test_players,
@@ -248,16 +279,10 @@ def test_showdown_no_show():
     assert room.log[0].players["w"].hand is None
 
 
-def test_fold_to_big_blind(monkeypatch):
+def test_fold_to_big_blind(monkeypatch, seeded_room):
     monkeypatch.setattr(game, "random", Random(0))
 
-    game.delete_room("test")
-    game.register("test", "a", "blah a")
-    game.increment_balance("test", "a", name="blah a", amount=100)
-    game.register("test", "b", "blah b")
-    game.increment_balance("test", "a", name="blah b", amount=100)
-    game.register("test", "c", "other")
-    game.increment_balance("test", "a", name="other", amount=100)
+    _room("test").put(seeded_room.copy(deep=True))
 
     game.start("test", "a")
     assert len(_room("test").get()[1].log) == 0
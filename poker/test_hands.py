@@ -1,4 +1,3 @@
-from poker.hands import Card
 from poker.hands import Hand
 from poker.hands import Value
 from poker.hands import find_best_hand
@@ -6,10 +5,6 @@ from poker.hands import get_winners
 from itertools import count
 
 
-def _split_hand(value, cards):
-    return Hand(value, [Card(cards[i : i + 2]) for i in range(0, len(cards), 2)])
-
-
 def test_four():
     assert find_best_hand("AHQHQDQSQC3H2C") == Hand(Value.QUAD, "QHQDQSQCAH")
 
@@ -75,6 +70,9 @@ def test_two_pair():
     # There are three pairs, but the kicker is unpaired
     assert find_best_hand("ASAHKSKHJHJSQS") == Hand(Value.TWO_PAIRS, "ASAHKSKHQS")
 
+    # The unpaired kicker outranks the third pair, though it sorts lower as a string
+    assert find_best_hand("QDJDQHACASXHXC") == Hand(Value.TWO_PAIRS, "ACASQDQHJD")
+
 
 def test_pair():
     assert find_best_hand("ASADKS9H5H4H3H") == Hand(Value.PAIR, "ASADKS9H5H")
@@ -113,3 +111,13 @@ def test_comparison():
         (0, Hand(Value.STRAIGHT, "ASKDQCJSXH")),
         (2, Hand(Value.STRAIGHT, "ASKCQDJSXH")),
     ]
+
+
+def test_heads_up_winners():
+    win = (0, Hand(Value.PAIR, "ASADKS9H5H"))
+    lose = (1, Hand(Value.PAIR, "ASADKS9H4H"))
+    tie = (2, Hand(Value.PAIR, "AHACKD9C5C"))
+
+    assert get_winners([win, lose]) == [win]
+    assert get_winners([lose, win]) == [win]
+    assert get_winners([win, tie]) == [win, tie]